@@ -13,23 +13,48 @@ Schema is at https://github.com/igrigorik/gharchive.org/blob/master/bigquery/sch
 As you implement the above, make sure to write clean code with documentation and type hints. You may use AI.
 """
 
+import gzip
+import io
+import json
+import logging
+import mmap
+import multiprocessing
 import os
 
-from datetime import datetime
-
+from abc import ABC, abstractmethod
 from collections import defaultdict
-
-import json
-from typing import List, Iterable
-from dataclasses import dataclass, fields
+from concurrent.futures import ProcessPoolExecutor
+from heapq import nlargest
+from itertools import repeat
+from operator import itemgetter
+
+from typing import List, Iterable, Iterator
+from dataclasses import dataclass
+from datetime import date, datetime, time, timezone
 from enum import Enum
 
+try:
+    import orjson  # optional (see requirements.txt): SIMD parser that reads bytes
+except ImportError:
+    orjson = None
+
+# both parsers take raw bytes; orjson.JSONDecodeError subclasses json.JSONDecodeError,
+# while the stdlib parser raises UnicodeDecodeError on invalid UTF-8
+_loads = orjson.loads if orjson is not None else json.loads
+_PARSE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+# event types the analytics filter on, integer-encoded at parse time so every
+# type filter is an int compare; any other type is encoded as 0
+TYPE_CODE = {"PushEvent": 1, "PullRequestEvent": 2, "IssuesEvent": 3}
+TYPE_NAME = {code: name for name, code in TYPE_CODE.items()}
+PUSH_EVENT = TYPE_CODE["PushEvent"]
+
 
 class ActionCategory(Enum):
-    ACTIVITY = "any"
-    PRS = "PullRequestEvent"
-    ISSUES = "IssuesEvent"
-    COMMITS = "PushEvent"
+    ACTIVITY = -1  # any type of action, never a TYPE_CODE
+    PRS = TYPE_CODE["PullRequestEvent"]
+    ISSUES = TYPE_CODE["IssuesEvent"]
+    COMMITS = PUSH_EVENT
 
 
 @dataclass
@@ -38,29 +63,24 @@ class Item:
     timestamp: int
 
 
-@dataclass
-class User:
-    id: int
-    login: str
-    url: str
-    avatar_url: str
+# The subset of a GHArchive record that the analytics actually read, as a plain
+# tuple in Analytic.update argument order:
+# (type code, actor_id, repo_id, repo_name, repo_url, created_at)
+# Records only live until every analytic has seen them, so no per-record class is kept
+Event = tuple[int, int, int, str, str, str]
 
 
-@dataclass
-class Repo:
-    id: int
-    name: str
-    url: str
+logger = logging.getLogger(__name__)
 
+# undecodable or incomplete lines are counted, but only every this many is logged
+BAD_LINE_LOG_EVERY = 10_000
 
-@dataclass
-class Action:
-    id: str
-    type: str
-    public: bool  # always true since private actions are not recorded
-    actor: User
-    repo: Repo
-    created_at: str
+
+def file_stem(name: str) -> str:
+    """
+    "2015-01-01-12.json.gz" and "2015-01-01-12.json" both give "2015-01-01-12"
+    """
+    return name.removesuffix(".gz").removesuffix(".json")
 
 
 class DataReader:
@@ -68,10 +88,13 @@ class DataReader:
         if file:
             self.files: List[str] = [os.path.join(directory, file)]
         elif directory:
+            names: dict[str, str] = {}
+            for f in sorted(os.listdir(directory)):
+                if f.endswith((".json", ".json.gz")):
+                    # one file per hour: x.json sorts before x.json.gz and wins
+                    names.setdefault(file_stem(f), f)
             self.files = [
-                os.path.join(directory, f)
-                for f in sorted(os.listdir(directory))
-                if f.endswith(".json")
+                os.path.join(directory, names[stem]) for stem in sorted(names)
             ]
         else:
             raise ValueError("Either directory or file must be provided")
@@ -79,45 +102,101 @@ class DataReader:
         self.file_iter: Iterable = iter(self.files)
         self.current_file = None
         self.current_line_iter = None
+        self.needles: tuple[bytes, ...] = ()
+        self.n_bad_lines = 0
 
     def _open_next_file(self) -> None:
         try:
             next_file = next(self.file_iter)
-            print(f"Opening file: {next_file}")
-            self.current_file = open(next_file, "r", encoding="utf-8", errors="replace")
-            self.current_line_iter = iter(self.current_file)
+            logger.debug("Opening file: %s", next_file)
+            # bytes all the way: the JSON parser validates UTF-8 itself
+            if next_file.endswith(".gz"):
+                self.current_file = gzip.open(next_file, "rb")
+                self.current_line_iter = iter(self.current_file)
+            elif os.path.getsize(next_file) == 0:  # mmap can't map an empty file
+                self.current_file = io.BytesIO()
+                self.current_line_iter = iter(self.current_file)
+            else:
+                with open(next_file, "rb") as f:
+                    self.current_file = mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ
+                    )
+                # readline scans the mapped pages for newlines in C, no read buffer copies
+                self.current_line_iter = iter(self.current_file.readline, b"")
         except StopIteration:
             self.current_file = None
             self.current_line_iter = None
 
-    def _dict_to_obj(self, data, obj_type) -> Action | User | Repo:
-        action_keys = {f.name for f in fields(obj_type)}
-        filtered_data = {k: v for k, v in data.items() if k in action_keys}
-        return obj_type(**filtered_data)
-
     def __iter__(self) -> "DataReader":
+        # restart from the first file so the same reader can be streamed again
+        if self.current_file is not None:
+            self.current_file.close()
+        self.file_iter = iter(self.files)
+        self.current_file = None
+        self.current_line_iter = None
+        self.needles = ()
+        self.n_bad_lines = 0
         return self
 
-    def __next__(self) -> Action | User | Repo:
+    def prefilter(self, needles: tuple[bytes, ...]) -> Iterator[Event]:
+        """
+        restarts the reader, only parsing lines that contain one of the needles;
+        a raw substring check is much cheaper than a JSON parse. Needles only
+        narrow the candidates, matching records must still be checked
+
+        the needles stay set until the stream ends or the reader is restarted
+        """
+        iter(self)
+        self.needles = needles
+        # a plain callable iterator: looping over it must not go through
+        # __iter__ again, which would restart the reader and drop the needles
+        return iter(self.__next__, None)
+
+    def _skip_bad_line(self, line: bytes, error: Exception) -> None:
+        # sampled so a corrupt file can't turn the read loop into a stream of writes
+        self.n_bad_lines += 1
+        if self.n_bad_lines % BAD_LINE_LOG_EVERY == 1:
+            logger.warning(
+                "Skipping line (%d bad so far), %r: %r",
+                self.n_bad_lines,
+                error,
+                line[:200],
+            )
+
+    def __next__(self) -> Event:
+        needles = self.needles
         while True:
             if self.current_line_iter is None:
                 self._open_next_file()
                 if self.current_line_iter is None:
+                    self.needles = ()
                     raise StopIteration
-            try:
-                line = next(self.current_line_iter)
-                data = json.loads(line)
-                action = self._dict_to_obj(data, Action)
-                action.actor = self._dict_to_obj(data["actor"], User)
-                action.repo = self._dict_to_obj(data["repo"], Repo)
-                return action
-            except StopIteration:
-                self.current_file.close()
-                self.current_line_iter = None
-            except json.JSONDecodeError:
-                print(f"Skipping line: {line}")
-            except KeyError as e:
-                print(f"Missing key {e} in line: {line}")
+            # resumes where the previous call returned
+            for line in self.current_line_iter:
+                if needles and not any(n in line for n in needles):
+                    continue
+                try:
+                    try:
+                        data = _loads(line)
+                    except _PARSE_ERRORS:
+                        # invalid UTF-8 is replaced, as a text-mode reader would
+                        data = _loads(line.decode("utf-8", "replace"))
+                    # pull only the fields we use; payload, org etc. are never touched
+                    actor = data["actor"]
+                    repo = data["repo"]
+                    return (
+                        TYPE_CODE.get(data["type"], 0),
+                        actor["id"],
+                        repo["id"],
+                        repo["name"],
+                        repo["url"],
+                        data["created_at"],
+                    )
+                # not JSON, missing keys, or the wrong shape ([1, 2], "actor": null)
+                except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    self._skip_bad_line(line, e)
+            self.current_file.close()
+            self.current_line_iter = None
 
 
 @dataclass
@@ -133,95 +212,363 @@ class ResRepo:
     num_users: int
 
 
-class AnalyticsEngine:
-    def __init__(self, reader: DataReader) -> None:
-        self.actions: List[Action] = list(reader)
-
-    def top_k_users_by(
-        self, target: int, category: ActionCategory | None = None
-    ) -> List[ResUser]:
+@dataclass
+class Report:
+    top_activity: List[ResUser]
+    top_prs: List[ResUser]
+    top_issues: List[ResUser]
+    top_commits: List[ResUser]
+    commits_at: bool
+    repos: List[ResRepo]
+
+
+class Analytic(ABC):
+    """
+    Accumulates a single result while the records stream past; see AnalyticsEngine.run
+
+    needle, when set, is a byte string every line relevant to the analytic contains
+    """
+
+    needle: bytes | None = None
+
+    @abstractmethod
+    def update(
+        self,
+        type_code: int,
+        actor_id: int,
+        repo_id: int,
+        repo_name: str,
+        repo_url: str,
+        created_at: str,
+    ) -> None: ...
+
+    @abstractmethod
+    def result(self): ...
+
+    @abstractmethod
+    def merge(self, other: "Analytic") -> None:
         """
-        list of possible categories:
-        - None or ActionCategory.ACTIVITY: any type of actions
-        - ActionCategory.PRS: PullRequestEvent
-        - ActionCategory.ISSUES: IssuesEvent
-        - ActionCategory.COMMITS: PushEvent
+        folds in the state of an analytic of the same kind that saw other records
         """
-        action_filter = category.value if category else ActionCategory.ACTIVITY.value
 
-        users: dict[int, int] = defaultdict(int)
-        for action in self.actions:
-            users[action.actor.id] += (
-                action.type == action_filter or action_filter == "any"
-            )
-
-        sorted_users = sorted(users.items(), key=lambda x: x[1], reverse=True)
-        top_k_users = sorted_users[:target]
-        return [ResUser(id=user_id, ranking=score) for user_id, score in top_k_users]
-
-    def commits_at(self, target: str) -> bool:
+    @abstractmethod
+    def empty_copy(self) -> "Analytic":
         """
-        time should be in 24-hour clock format
+        a new analytic with the same parameters and no accumulated state
         """
 
-        for action in self.actions:
-            iso_time = action.created_at
-            dt = datetime.strptime(iso_time, "%Y-%m-%dT%H:%M:%SZ")
-            time_only = dt.strftime("%H:%M:%S")
-            if time_only == target:
-                return True
-        return False
-
-    def filter_repo_commit(
-        self, maximum_target: int, minimum_target: int | None = None
-    ) -> List[ResRepo]:
-        repos = defaultdict(lambda: {"name": "", "url": "", "users": set()})
-
-        for action in self.actions:
-            if action.type == "PushEvent":
-                repo = action.repo
-                user = action.actor
 
-                if not repos[repo.id]["name"]:
-                    repos[repo.id]["name"] = repo.name
-                    repos[repo.id]["url"] = repo.url
+class TopKUsers(Analytic):
+    """
+    list of possible categories:
+    - ActionCategory.PRS: PullRequestEvent
+    - ActionCategory.ISSUES: IssuesEvent
+    - ActionCategory.COMMITS: PushEvent
+    for any type of actions (None or ActionCategory.ACTIVITY) use TopKAllUsers
+
+    users with equal counts are ranked by their first matching event; for a category
+    only matching lines are parsed, so earlier non-matching events don't count
+    """
+
+    counts_any_type = False  # set by TopKAllUsers, which skips the type filter
+
+    def __init__(self, target: int, category: ActionCategory) -> None:
+        if category in (None, ActionCategory.ACTIVITY) and not self.counts_any_type:
+            raise ValueError("TopKUsers needs an event category, see TopKAllUsers")
+        self.target = target
+        self.category = category
+        self.action_filter = category.value
+        if not self.counts_any_type:
+            self.needle = f'"{TYPE_NAME[self.action_filter]}"'.encode()
+        # one entry per distinct user, so memory doesn't grow with the record count
+        self.users: dict[int, int] = defaultdict(int)
+
+    def update(
+        self,
+        type_code: int,
+        actor_id: int,
+        repo_id: int,
+        repo_name: str,
+        repo_url: str,
+        created_at: str,
+    ) -> None:
+        if type_code == self.action_filter:
+            self.users[actor_id] += 1
+
+    def merge(self, other: "TopKUsers") -> None:
+        # new users keep the other side's first-seen order, as a sequential run would
+        for actor_id, count in other.users.items():
+            self.users[actor_id] += count
+
+    def empty_copy(self) -> "TopKUsers":
+        return TopKUsers(self.target, self.category)
+
+    def result(self) -> List[ResUser]:
+        # partial selection, O(U log k) rather than sorting every user
+        top_k_users = nlargest(self.target, self.users.items(), key=itemgetter(1))
+        return [ResUser(id=user_id, ranking=score) for user_id, score in top_k_users]
 
-                repos[repo.id]["users"].add(user.id)
 
+class TopKAllUsers(TopKUsers):
+    """
+    top-k users over any type of actions (ActionCategory.ACTIVITY); a class of its
+    own so the per-record update carries no loop-invariant filter check
+    """
+
+    counts_any_type = True
+
+    def __init__(self, target: int) -> None:
+        super().__init__(target, ActionCategory.ACTIVITY)
+
+    def update(
+        self,
+        type_code: int,
+        actor_id: int,
+        repo_id: int,
+        repo_name: str,
+        repo_url: str,
+        created_at: str,
+    ) -> None:
+        self.users[actor_id] += 1
+
+    def empty_copy(self) -> "TopKAllUsers":
+        return TopKAllUsers(self.target)
+
+
+class CommitsAt(Analytic):
+    """
+    time should be in 24-hour clock format; records are stamped in UTC, so a target
+    with an offset (e.g. "12:00:00-08:00" for PST) is converted to UTC first
+    """
+
+    def __init__(self, target: str) -> None:
+        # parsed once up front: rejects malformed input and canonicalises it to the
+        # HH:MM:SS form the per-record slice compare expects (e.g. "12:00" matches)
+        parsed = time.fromisoformat(target)
+        if parsed.microsecond:
+            raise ValueError(f"{target!r}: records only have whole-second timestamps")
+        if parsed.tzinfo is not None:
+            on_any_day = datetime.combine(date(2000, 1, 1), parsed)
+            parsed = on_any_day.astimezone(timezone.utc).time()
+        self.target = parsed.strftime("%H:%M:%S")
+        self.found = False
+        self.needle = f"T{self.target}Z".encode()
+
+    def update(
+        self,
+        type_code: int,
+        actor_id: int,
+        repo_id: int,
+        repo_name: str,
+        repo_url: str,
+        created_at: str,
+    ) -> None:
+        # created_at is fixed-width "YYYY-MM-DDTHH:MM:SSZ", so HH:MM:SS is [11:19]
+        if created_at[11:19] == self.target:
+            self.found = True
+
+    def result(self) -> bool:
+        return self.found
+
+    def merge(self, other: "CommitsAt") -> None:
+        self.found = self.found or other.found
+
+    def empty_copy(self) -> "CommitsAt":
+        return CommitsAt(self.target)
+
+
+class RepoCommitFilter(Analytic):
+    needle = b'"PushEvent"'
+
+    def __init__(self, maximum_target: int, minimum_target: int | None = None) -> None:
+        self.maximum_target = maximum_target
+        self.minimum_target = minimum_target
+        self.repo_meta: dict[int, tuple[str, str]] = {}  # id -> (name, url)
+        self.repo_users: dict[int, List[int]] = defaultdict(list)
+
+    def update(
+        self,
+        type_code: int,
+        actor_id: int,
+        repo_id: int,
+        repo_name: str,
+        repo_url: str,
+        created_at: str,
+    ) -> None:
+        if type_code == PUSH_EVENT:
+            self.repo_meta.setdefault(repo_id, (repo_name, repo_url))
+
+            # distinct users, but only up to one past the cap: beyond that the
+            # repo is rejected anyway, so the list stays short to scan
+            users = self.repo_users[repo_id]
+            if len(users) <= self.maximum_target and actor_id not in users:
+                users.append(actor_id)
+
+    def merge(self, other: "RepoCommitFilter") -> None:
+        for repo_id, meta in other.repo_meta.items():
+            self.repo_meta.setdefault(repo_id, meta)
+        for repo_id, other_users in other.repo_users.items():
+            users = self.repo_users[repo_id]
+            for actor_id in other_users:
+                if len(users) <= self.maximum_target and actor_id not in users:
+                    users.append(actor_id)
+
+    def empty_copy(self) -> "RepoCommitFilter":
+        return RepoCommitFilter(self.maximum_target, self.minimum_target)
+
+    def result(self) -> List[ResRepo]:
         res = []
 
-        for repo, info in repos.items():
-            num_users = len(info["users"])
+        for repo_id, users in self.repo_users.items():
+            num_users = len(users)
             if (
-                minimum_target is None or num_users >= minimum_target
-            ) and num_users <= maximum_target:
-                res.append(
-                    ResRepo(name=info["name"], url=info["url"], num_users=num_users)
-                )
+                self.minimum_target is None or num_users >= self.minimum_target
+            ) and num_users <= self.maximum_target:
+                name, url = self.repo_meta[repo_id]
+                res.append(ResRepo(name=name, url=url, num_users=num_users))
 
         return res
 
 
-jan1_2015 = DataReader(directory="data")
-analyise_2015 = AnalyticsEngine(jan1_2015)
+def _stream(reader: DataReader, analytics: List[Analytic]) -> List[Analytic]:
+    updates = [analytic.update for analytic in analytics]
+    needles = tuple({analytic.needle for analytic in analytics})
+    if None in needles:
+        needles = ()
+    for event in reader.prefilter(needles):
+        for update in updates:
+            update(*event)
+    return analytics
 
-target_tops = 10
-print(f"Top 10 users on overall activity: {analyise_2015.top_k_users_by(target_tops)}")
-print(
-    f"Top 10 users on prs: {analyise_2015.top_k_users_by(target_tops, category=ActionCategory.PRS)}"
-)
-print(
-    f"Top 10 users on issues: {analyise_2015.top_k_users_by(target_tops, category=ActionCategory.ISSUES)}"
-)
-print(
-    f"Top 10 users on commits: {analyise_2015.top_k_users_by(target_tops, category=ActionCategory.COMMITS)}"
-)
 
-jan1_2015_1200 = DataReader(directory="data", file="2015-01-01-12.json")
-analyise_1200_only = AnalyticsEngine(jan1_2015_1200)
+def _process_file(path: str, analytics: List[Analytic]) -> tuple[List[Analytic], int]:
+    # runs in a worker process on its own pickled copy of the empty analytics
+    reader = DataReader(*os.path.split(path))
+    return _stream(reader, analytics), reader.n_bad_lines
 
-print(f"Action taken right on 12:00:00: {analyise_1200_only.commits_at('12:59:59')}")
 
-print(
-    f"Repos with user count from 5 to 10: {analyise_2015.filter_repo_commit(minimum_target=5, maximum_target=10)}"
+# fork lets workers reuse the parent's imported modules instead of re-importing
+_MP_CONTEXT = (
+    multiprocessing.get_context("fork")
+    if "fork" in multiprocessing.get_all_start_methods()
+    else None
 )
+
+
+class AnalyticsEngine:
+    def __init__(self, reader: DataReader) -> None:
+        self.reader = reader
+
+    def run(self, analytics: List[Analytic], workers: int | None = None) -> list:
+        """
+        streams the reader once, feeding every record to all analytics;
+        returns their results in the same order
+
+        files are independent, so with several of them each one is processed in
+        its own worker (up to workers, default os.cpu_count()) and the partial
+        analytics are merged back in file order, as are the workers' bad-line
+        counts into reader.n_bad_lines. Workers start from empty copies, so both
+        paths add this run's records on top of any state the analytics already hold
+        """
+        files = self.reader.files
+        if workers == 1 or len(files) < 2:
+            _stream(self.reader, analytics)
+        else:
+            empties = [analytic.empty_copy() for analytic in analytics]
+            self.reader.n_bad_lines = 0
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=_MP_CONTEXT
+            ) as executor:
+                results = executor.map(_process_file, files, repeat(empties))
+                for partials, n_bad_lines in results:
+                    for analytic, partial in zip(analytics, partials):
+                        analytic.merge(partial)
+                    self.reader.n_bad_lines += n_bad_lines
+        return [analytic.result() for analytic in analytics]
+
+    def run_all(
+        self,
+        target: int,
+        at_time: str,
+        maximum_target: int,
+        minimum_target: int | None = None,
+        workers: int | None = None,
+    ) -> Report:
+        """
+        every analytic fused into a single pass over the data
+        """
+        return Report(
+            *self.run(
+                [
+                    TopKAllUsers(target),
+                    TopKUsers(target, category=ActionCategory.PRS),
+                    TopKUsers(target, category=ActionCategory.ISSUES),
+                    TopKUsers(target, category=ActionCategory.COMMITS),
+                    CommitsAt(at_time),
+                    RepoCommitFilter(maximum_target, minimum_target),
+                ],
+                workers=workers,
+            )
+        )
+
+    # the single-analytic helpers default to one process: a pool only pays off
+    # when several analytics share the pass over many large files
+
+    def top_k_users_by(
+        self,
+        target: int,
+        category: ActionCategory | None = None,
+        workers: int | None = 1,
+    ) -> List[ResUser]:
+        analytic = (
+            TopKAllUsers(target)
+            if category in (None, ActionCategory.ACTIVITY)
+            else TopKUsers(target, category)
+        )
+        return self.run([analytic], workers=workers)[0]
+
+    def commits_at(self, target: str, workers: int | None = 1) -> bool:
+        return self.run([CommitsAt(target)], workers=workers)[0]
+
+    def filter_repo_commit(
+        self,
+        maximum_target: int,
+        minimum_target: int | None = None,
+        workers: int | None = 1,
+    ) -> List[ResRepo]:
+        return self.run(
+            [RepoCommitFilter(maximum_target, minimum_target)], workers=workers
+        )[0]
+
+
+if __name__ == "__main__":
+    jan1_2015 = DataReader(directory="data")
+    analyise_2015 = AnalyticsEngine(jan1_2015)
+
+    target_tops = 10
+    top_activity, top_prs, top_issues, top_commits, repos_5_to_10 = analyise_2015.run(
+        [
+            TopKAllUsers(target_tops),
+            TopKUsers(target_tops, category=ActionCategory.PRS),
+            TopKUsers(target_tops, category=ActionCategory.ISSUES),
+            TopKUsers(target_tops, category=ActionCategory.COMMITS),
+            RepoCommitFilter(minimum_target=5, maximum_target=10),
+        ]
+    )
+    print(f"Top 10 users on overall activity: {top_activity}")
+    print(f"Top 10 users on prs: {top_prs}")
+    print(f"Top 10 users on issues: {top_issues}")
+    print(f"Top 10 users on commits: {top_commits}")
+
+    # GHArchive serves the hour as .json.gz; an unpacked .json works too
+    (hour_12,) = [
+        f for f in jan1_2015.files if file_stem(os.path.basename(f)) == "2015-01-01-12"
+    ]
+    jan1_2015_1200 = DataReader(*os.path.split(hour_12))
+    analyise_1200_only = AnalyticsEngine(jan1_2015_1200)
+
+    print(
+        f"Action taken right on 12:00:00: {analyise_1200_only.commits_at('12:59:59')}"
+    )
+
+    print(f"Repos with user count from 5 to 10: {repos_5_to_10}")
@@ -0,0 +1,285 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app
+
+
+def record(
+    type="PushEvent",
+    actor_id=1,
+    repo_id=10,
+    repo_name="owner/repo",
+    created_at="2015-01-01T12:00:00Z",
+) -> bytes:
+    return json.dumps(
+        {
+            "id": "1",
+            "type": type,
+            "public": True,
+            "actor": {"id": actor_id, "login": "user"},
+            "repo": {
+                "id": repo_id,
+                "name": repo_name,
+                "url": f"https://api.github.com/repos/{repo_name}",
+            },
+            "payload": {},
+            "created_at": created_at,
+        },
+        separators=(",", ":"),
+        ensure_ascii=False,
+    ).encode()
+
+
+class DataDirTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.directory = self._tmp.name
+
+    def write(self, name: str, lines: list[bytes]) -> None:
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(b"\n".join(lines) + b"\n")
+
+
+class DataReaderTest(DataDirTestCase):
+    def test_invalid_utf8_is_replaced_not_dropped(self) -> None:
+        line = record(repo_name="owner/r\u00e9po").replace("\u00e9".encode(), b"\xff")
+        self.write("2015-01-01-0.json", [line])
+
+        for loads in (app._loads, json.loads):
+            with self.subTest(loads=loads), mock.patch.object(app, "_loads", loads):
+                events = list(app.DataReader(directory=self.directory))
+                self.assertEqual(len(events), 1)
+                self.assertEqual(events[0][3], "owner/r\ufffdpo")
+
+    def test_one_file_per_hour(self) -> None:
+        self.write("2015-01-01-1.json", [record(actor_id=1)])
+        self.write("2015-01-01-0.json", [record(actor_id=2)])
+        with gzip.open(os.path.join(self.directory, "2015-01-01-0.json.gz"), "wb") as f:
+            f.write(record(actor_id=3) + b"\n")
+        with gzip.open(os.path.join(self.directory, "2015-01-01-2.json.gz"), "wb") as f:
+            f.write(record(actor_id=4) + b"\n")
+
+        reader = app.DataReader(directory=self.directory)
+        self.assertEqual(
+            [os.path.basename(f) for f in reader.files],
+            ["2015-01-01-0.json", "2015-01-01-1.json", "2015-01-01-2.json.gz"],
+        )
+        self.assertEqual([event[1] for event in reader], [2, 1, 4])
+
+    def test_bad_lines_are_counted_and_skipped(self) -> None:
+        no_actor = record().replace(b'{"id":1,"login":"user"}', b"null")
+        self.assertIn(b'"actor":null', no_actor)
+        self.write(
+            "2015-01-01-0.json",
+            [b"garbage", b'{"type":"PushEvent"}', b"[1,2]", no_actor, record()],
+        )
+
+        reader = app.DataReader(directory=self.directory)
+        with self.assertLogs(app.logger, "WARNING"):
+            events = list(reader)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(reader.n_bad_lines, 4)
+
+        # a worker process must survive them too
+        self.write("2015-01-01-1.json", [b"[1,2]", record(actor_id=2)])
+        reader = app.DataReader(directory=self.directory)
+        with mock.patch.object(app.logger, "disabled", True):
+            (users,) = app.AnalyticsEngine(reader).run([app.TopKAllUsers(5)], workers=2)
+        self.assertEqual(len(users), 2)
+        self.assertEqual(reader.n_bad_lines, 5)
+
+
+class PrefilterTest(DataDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.write(
+            "2015-01-01-12.json",
+            [
+                record(type="PushEvent", actor_id=1, created_at="2015-01-01T12:00:01Z"),
+                record(
+                    type="WatchEvent", actor_id=2, created_at="2015-01-01T12:59:59Z"
+                ),
+                b"garbage",
+                record(type="PushEvent", actor_id=3, created_at="2015-01-01T12:00:02Z"),
+            ],
+        )
+        self.parsed = 0
+        loads = app._loads
+
+        def counting_loads(line):
+            self.parsed += 1
+            return loads(line)
+
+        patcher = mock.patch.object(app, "_loads", counting_loads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.engine = app.AnalyticsEngine(app.DataReader(directory=self.directory))
+
+    def test_lines_without_needle_are_not_parsed(self) -> None:
+        self.assertTrue(self.engine.commits_at("12:59:59"))
+        self.assertEqual(self.parsed, 1)
+
+    def test_push_filter_parses_only_push_lines(self) -> None:
+        (repos,) = self.engine.run([app.RepoCommitFilter(10, 1)], workers=1)
+        self.assertEqual(repos, [app.ResRepo("owner/repo", repos[0].url, 2)])
+        self.assertEqual(self.parsed, 2)
+
+    def test_unfiltered_stream_after_prefilter_sees_every_line(self) -> None:
+        list(self.engine.reader.prefilter((b'"PushEvent"',)))
+        self.parsed = 0
+        with self.assertLogs(app.logger, "WARNING"):
+            events = list(self.engine.reader)
+        self.assertEqual(len(events), 3)
+        self.assertEqual(self.parsed, 5)  # garbage is retried once
+
+
+class TopKUsersTest(DataDirTestCase):
+    def test_ties_ranked_by_first_matching_event(self) -> None:
+        self.write(
+            "2015-01-01-0.json",
+            [
+                record(type="WatchEvent", actor_id=2),
+                record(type="PushEvent", actor_id=1),
+                record(type="PushEvent", actor_id=2),
+                record(type="PushEvent", actor_id=3),
+                record(type="PushEvent", actor_id=3),
+            ],
+        )
+        engine = app.AnalyticsEngine(app.DataReader(directory=self.directory))
+
+        commits, activity = engine.run(
+            [app.TopKUsers(3, app.ActionCategory.COMMITS), app.TopKAllUsers(2)]
+        )
+        self.assertEqual(
+            commits,
+            [app.ResUser(3, 2), app.ResUser(1, 1), app.ResUser(2, 1)],
+        )
+        self.assertEqual(activity, [app.ResUser(2, 2), app.ResUser(3, 2)])
+        self.assertEqual(
+            engine.top_k_users_by(2, app.ActionCategory.ACTIVITY), activity
+        )
+
+    def test_overall_activity_needs_top_k_all_users(self) -> None:
+        for category in (None, app.ActionCategory.ACTIVITY):
+            with self.subTest(category=category), self.assertRaises(ValueError):
+                app.TopKUsers(3, category)
+
+
+class ParallelRunTest(DataDirTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        types = [
+            "PushEvent",
+            "PushEvent",
+            "PullRequestEvent",
+            "IssuesEvent",
+            "WatchEvent",
+        ]
+        for hour in range(4):
+            lines = [b"garbage"]
+            for i in range(300):
+                lines.append(
+                    record(
+                        type=types[(i * 7 + hour) % len(types)],
+                        actor_id=(i * 13 + hour * 5) % 40,
+                        repo_id=(i * 3 + hour) % 25,
+                        repo_name=f"owner/repo{(i * 3 + hour) % 25}",
+                        created_at=f"2015-01-01T{hour:02d}:{i % 60:02d}:00Z",
+                    )
+                )
+            self.write(f"2015-01-01-{hour}.json", lines)
+        # bad lines are checked through n_bad_lines; workers can't log to assertLogs
+        self.enterContext(mock.patch.object(app.logger, "disabled", True))
+
+    def run_all(self, workers: int | None) -> tuple[app.Report, int]:
+        reader = app.DataReader(directory=self.directory)
+        report = app.AnalyticsEngine(reader).run_all(
+            10, "02:59:00", maximum_target=12, minimum_target=3, workers=workers
+        )
+        return report, reader.n_bad_lines
+
+    def test_parallel_matches_sequential(self) -> None:
+        sequential, sequential_bad = self.run_all(workers=1)
+        parallel, parallel_bad = self.run_all(workers=3)
+
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(parallel_bad, sequential_bad)
+        self.assertEqual(parallel_bad, 4)
+        self.assertTrue(sequential.commits_at)
+        self.assertTrue(sequential.repos)
+
+    def test_reused_analytics_accumulate_the_same_on_both_paths(self) -> None:
+        engine = app.AnalyticsEngine(app.DataReader(directory=self.directory))
+        (once,) = engine.run([app.TopKAllUsers(3)], workers=1)
+
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                analytic = app.TopKAllUsers(3)
+                engine.run([analytic], workers=workers)
+                (twice,) = engine.run([analytic], workers=workers)
+                self.assertEqual(
+                    [user.ranking for user in twice],
+                    [2 * user.ranking for user in once],
+                )
+
+    def test_capped_user_lists_are_unioned_across_files(self) -> None:
+        # repo 1 has 2 distinct pushers per file but 4 overall; repo 2 has 1 overall
+        for hour, users in enumerate([(100, 101), (101, 102), (102, 103)]):
+            self.write(
+                f"2015-01-01-{hour}.json",
+                [record(actor_id=user, repo_id=1) for user in users]
+                + [record(actor_id=200, repo_id=2, repo_name="owner/other")],
+            )
+        os.remove(os.path.join(self.directory, "2015-01-01-3.json"))
+        engine = app.AnalyticsEngine(app.DataReader(directory=self.directory))
+
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                self.assertEqual(
+                    engine.filter_repo_commit(3, workers=workers),
+                    [
+                        app.ResRepo(
+                            "owner/other", "https://api.github.com/repos/owner/other", 1
+                        )
+                    ],
+                )
+                (repos,) = engine.run([app.RepoCommitFilter(4, 4)], workers=workers)
+                self.assertEqual([repo.num_users for repo in repos], [4])
+
+
+class CommitsAtTest(unittest.TestCase):
+    def test_target_is_canonicalised(self) -> None:
+        self.assertEqual(app.CommitsAt("12:00").target, "12:00:00")
+        self.assertEqual(app.CommitsAt("12:59:59Z").target, "12:59:59")
+
+    def test_offset_target_is_converted_to_utc(self) -> None:
+        analytic = app.CommitsAt("12:00:00-08:00")
+        self.assertEqual(analytic.target, "20:00:00")
+        self.assertEqual(analytic.needle, b"T20:00:00Z")
+        self.assertEqual(app.CommitsAt("12:59:59+05:00").target, "07:59:59")
+
+    def test_sub_second_target_is_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            app.CommitsAt("12:59:59.5")
+
+
+class AnalyticTest(unittest.TestCase):
+    def test_missing_override_fails_at_construction(self) -> None:
+        class NoMerge(app.Analytic):
+            def update(self, *fields) -> None:
+                pass
+
+            def result(self) -> None:
+                return None
+
+        with self.assertRaises(TypeError):
+            NoMerge()
+
+
+if __name__ == "__main__":
+    unittest.main()